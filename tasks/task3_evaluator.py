@@ -1,10 +1,11 @@
 from tqdm import tqdm
 import os
 import logging
-import copy
 import json
-from utils.file_utils import save_json, load_jsonl, save_jsonl, append_to_jsonl
+from concurrent.futures import ThreadPoolExecutor
+from utils.file_utils import save_json, load_jsonl, save_jsonl, AsyncJsonlWriter
 from utils.prompts import build_teacher_prompt, build_guided_student_prompt
+from utils.batching import prefetched_batches
 from utils.metrics import extract_last_boxed_answer, extract_last_knowledge_object, calculate_accuracy
 from models.student import StudentModel
 
@@ -12,7 +13,7 @@ from models.student import StudentModel
 logger = logging.getLogger(__name__)
 
 
-def generate_knowledge_for_task3(model, results_dir, args):
+def generate_knowledge_for_task3(model, results_dir, args, on_progress=None):
     # Generate output file path
     knowledge_filename = "task3_knowledge.jsonl"
     knowledge_filepath = os.path.join(results_dir, knowledge_filename)
@@ -25,8 +26,10 @@ def generate_knowledge_for_task3(model, results_dir, args):
         knowledge_results = []
         logger.info("Starting knowledge generation for task 3")
     
-    # Load evaluation dataset
+    # Load evaluation dataset, sorted by prompt length so batches pad to
+    # similar lengths; the deterministic sort keeps resume accounting valid
     evaluation_data = load_jsonl(os.path.join(args.data_dir, "datasets", "task3.jsonl"))
+    evaluation_data.sort(key=lambda sample: len(sample["material"]) + len(sample["guideline"]))
     total_samples = len(evaluation_data)
     logger.info(f"Loaded {total_samples} evaluation samples")
     
@@ -39,33 +42,48 @@ def generate_knowledge_for_task3(model, results_dir, args):
     
     logger.info(f"Processing {samples_to_process} new samples")
     
-    # Process each sample
-    for sample_idx, sample in enumerate(tqdm(evaluation_data, desc="Processing samples")):
-        # Skip if this sample has already been processed
-        if sample_idx < len(knowledge_results):
-            continue
-        
-        try:
-            # Generate prompt and get model response
-            system_prompt, user_prompt = build_teacher_prompt(sample["guideline"], sample["material"])
-            model_response = model.chat(
-                user_prompt, 
-                system_prompt=system_prompt, 
-                max_new_tokens=args.max_length
-            )
-            
-            # Extract knowledge and store results
-            sample["response"] = model_response
-            sample["knowledge"] = extract_last_knowledge_object(model_response)
-            
-            # Save results
-            append_to_jsonl(sample, knowledge_filepath)
-            knowledge_results.append(sample)
-            
-        except Exception as e:
-            logger.error(f"Error processing sample {sample_idx}: {e}")
-            # Continue with next sample even if current one fails
-            continue
+    # Write results on a background thread so disk I/O overlaps GPU work
+    knowledge_writer = AsyncJsonlWriter(knowledge_filepath)
+
+    def build_prompts(batch):
+        prompt_pairs = [build_teacher_prompt(sample["guideline"], sample["material"]) for sample in batch]
+        return [pair[0] for pair in prompt_pairs], [pair[1] for pair in prompt_pairs]
+
+    # Process pending samples in batches to share GPU weight reads; the next
+    # batch's prompts are built while the GPU generates
+    pending_samples = evaluation_data[len(knowledge_results):]
+    try:
+        with tqdm(total=len(pending_samples), desc="Processing samples") as progress_bar:
+            for batch, (system_prompts, user_prompts) in prefetched_batches(
+                    pending_samples, args.batch_size, build_prompts):
+                try:
+                    # Get model responses for the whole batch
+                    model_responses = model.chat_batch(
+                        user_prompts,
+                        system_prompts=system_prompts,
+                        max_new_tokens=args.max_length,
+                        do_sample=getattr(args, "do_sample", False)
+                    )
+
+                    # Extract knowledge and store results
+                    for sample, model_response in zip(batch, model_responses):
+                        sample["response"] = model_response
+                        sample["knowledge"] = extract_last_knowledge_object(model_response)
+                        knowledge_results.append(sample)
+
+                    # Save results
+                    knowledge_writer.extend(batch)
+
+                except Exception as e:
+                    logger.error(f"Error processing batch starting at sample {len(knowledge_results)}: {e}")
+                    # Continue with next batch even if current one fails
+                    continue
+                finally:
+                    progress_bar.update(len(batch))
+                    if on_progress is not None:
+                        on_progress(len(knowledge_results), total_samples)
+    finally:
+        knowledge_writer.close()
 
     logger.info(f"Completed knowledge generation for task 3. Processed {len(knowledge_results)} samples")
     
@@ -120,8 +138,13 @@ def run_evaluation_student(model, evaluation_data, results_dir, args):
         evaluation_results = []
         logger.info("Starting new evaluation run")
     
+    # Sort by prompt length so batches pad to similar lengths; the
+    # deterministic sort keeps resume accounting valid across restarts
+    evaluation_data.sort(
+        key=lambda sample: len(sample["material"]) + len(str(sample["knowledge"])) + len(sample["question"])
+    )
     total_samples = len(evaluation_data)
-    
+
     # Calculate how many samples need to be processed
     total_iterations = args.test_time
     samples_to_process = total_iterations * total_samples - len(evaluation_results)
@@ -131,34 +154,70 @@ def run_evaluation_student(model, evaluation_data, results_dir, args):
     else:
         logger.info(f"Processing {samples_to_process} samples across {total_iterations} iterations")
     
-    # Run evaluation for specified number of test iterations
-    for iteration in range(args.test_time):
-        logger.info(f"Starting evaluation iteration {iteration + 1}/{args.test_time}")
-        
-        for sample_idx, sample in enumerate(tqdm(evaluation_data, desc=f"Iteration {iteration + 1}")):
-            # Skip if this sample has already been processed in current iteration
-            result_index = sample_idx + iteration * total_samples
-            if result_index < len(evaluation_results):
+    # Write results on a background thread so disk I/O overlaps GPU work
+    results_writer = AsyncJsonlWriter(results_filepath)
+
+    try:
+        # Run evaluation for specified number of test iterations
+        for iteration in range(args.test_time):
+            logger.info(f"Starting evaluation iteration {iteration + 1}/{args.test_time}")
+
+            # Skip samples already processed in the current iteration
+            processed_count = min(max(len(evaluation_results) - iteration * total_samples, 0), total_samples)
+            pending_samples = evaluation_data[processed_count:]
+
+            # Greedy decoding is bit-for-bit identical across iterations, so
+            # copy the first iteration's results instead of re-running the GPU
+            if iteration > 0 and not getattr(args, "do_sample", False):
+                logger.info(f"Greedy decoding is deterministic; copying results for iteration {iteration + 1}")
+                first_iteration_results = evaluation_results[processed_count:total_samples]
+                evaluation_results.extend(first_iteration_results)
+                results_writer.extend(first_iteration_results)
                 continue
-            
-            # Generate prompt and get model response
-            system_prompt, question_prompt = build_guided_student_prompt(
-                sample["question"], 
-                sample["material"], 
-                sample["knowledge"] if isinstance(sample["knowledge"], str) 
-                else json.dumps(sample["knowledge"], indent=4, ensure_ascii=False)
-            )
-            
-            model_response = model.chat(question_prompt, system_prompt)
-            
-            # Extract prediction and store results
-            sample["response"] = model_response
-            sample["prediction"] = extract_last_boxed_answer(model_response)
-            
-            append_to_jsonl(sample, results_filepath)
-            evaluation_results.append(sample)
-        
-        logger.info(f"Completed iteration {iteration + 1}/{args.test_time}")
+
+            def build_prompts(batch):
+                prompt_pairs = [
+                    build_guided_student_prompt(
+                        sample["question"],
+                        sample["material"],
+                        sample["knowledge"] if isinstance(sample["knowledge"], str)
+                        else json.dumps(sample["knowledge"], indent=4, ensure_ascii=False)
+                    )
+                    for sample in batch
+                ]
+                return [pair[0] for pair in prompt_pairs], [pair[1] for pair in prompt_pairs]
+
+            # Process pending samples in batches to share GPU weight reads;
+            # the next batch's prompts are built while the GPU generates
+            with tqdm(total=len(pending_samples), desc=f"Iteration {iteration + 1}") as progress_bar:
+                for batch, (system_prompts, question_prompts) in prefetched_batches(
+                        pending_samples, args.batch_size, build_prompts):
+                    # Student answers are short; the teacher's free-form
+                    # knowledge generation keeps the full --max_length cap
+                    model_responses = model.chat_batch(
+                        question_prompts,
+                        system_prompts,
+                        max_new_tokens=getattr(args, "max_new_tokens_task3", None) or args.max_length,
+                        eval_mode=not getattr(args, "do_sample", False)
+                    )
+
+                    # Extract predictions and store fresh result dicts so the
+                    # shared evaluation_data stays read-only across students
+                    batch_results = []
+                    for sample, model_response in zip(batch, model_responses):
+                        batch_results.append({
+                            **sample,
+                            "response": model_response,
+                            "prediction": extract_last_boxed_answer(model_response)
+                        })
+                    evaluation_results.extend(batch_results)
+
+                    results_writer.extend(batch_results)
+                    progress_bar.update(len(batch_results))
+
+            logger.info(f"Completed iteration {iteration + 1}/{args.test_time}")
+    finally:
+        results_writer.close()
     
     # Calculate and save accuracy scores
     logger.info("Calculating accuracy scores...")
@@ -169,20 +228,66 @@ def run_evaluation_student(model, evaluation_data, results_dir, args):
 
 
 def run_evaluation_task3(model, results_dir, args):
+    student_names = ["qwen-1_8b", "qwen-7b", "qwen-14b", "yi-6b", "internlm2-7b"]
+    draft_name = getattr(args, "student_draft_model", None)
+    draft_model = None
+
+    def load_student(model_name):
+        return StudentModel(
+            model_name,
+            os.path.join(args.data_dir, "models", model_name),
+            quantization=getattr(args, "student_quantization", None),
+            draft_model=draft_model if model_name != draft_name else None,
+            torch_dtype=getattr(args, "torch_dtype", "auto")
+        )
+
+    loader = ThreadPoolExecutor(max_workers=1)
+    next_student = None
+
+    def preload_first_student(completed_samples, total_samples):
+        # Pipeline the teacher and student phases: once knowledge generation
+        # enters its final stretch, start reading the first student from disk
+        # so the load finishes around the time the teacher releases the GPU
+        nonlocal next_student
+        if next_student is None and completed_samples >= 0.9 * total_samples:
+            next_student = loader.submit(load_student, student_names[0])
+
     # Load and preprocess evaluation dataset
-    evaluation_data = generate_knowledge_for_task3(model, results_dir, args)
+    evaluation_data = generate_knowledge_for_task3(model, results_dir, args,
+                                                   on_progress=preload_first_student)
     total_samples = len(evaluation_data)
     logger.info(f"Loaded {total_samples} evaluation samples")
 
     model.release()
 
+    # Optional resident draft model for speculative decoding. The draft must
+    # share the target's tokenizer, and the legacy Qwen chat API cannot take
+    # one, so this only accelerates the standard chat-template students
+    if draft_name:
+        logger.info(f"Loading draft model {draft_name} for speculative decoding")
+        draft_model = StudentModel(draft_name, os.path.join(args.data_dir, "models", draft_name))
+
     accuracy_scores = {}
-    for model_name in ["qwen-1_8b", "qwen-7b", "qwen-14b", "yi-6b", "internlm2-7b"]:
-        logger.info(f"Test {model_name} student")
-        student_model = StudentModel(model_name, os.path.join(args.data_dir, "models", model_name))
-        accuracy_score = run_evaluation_student(student_model, copy.deepcopy(evaluation_data), results_dir, args)
-        accuracy_scores[model_name] = accuracy_score["overall"]
-        student_model.release()
+
+    # Load the next student on a background thread while the current one is
+    # still evaluating, hiding the disk read + weight copy behind GPU work
+    with loader:
+        if next_student is None:
+            next_student = loader.submit(load_student, student_names[0])
+        for model_idx, model_name in enumerate(student_names):
+            student_model = next_student.result()
+            if model_idx + 1 < len(student_names):
+                next_student = loader.submit(load_student, student_names[model_idx + 1])
+
+            logger.info(f"Test {model_name} student")
+            # evaluation_data is shared read-only across all five students;
+            # run_evaluation_student emits fresh result dicts per sample
+            accuracy_score = run_evaluation_student(student_model, evaluation_data, results_dir, args)
+            accuracy_scores[model_name] = accuracy_score["overall"]
+            student_model.release()
+
+    if draft_model is not None:
+        draft_model.release()
     values = list(accuracy_scores.values())
     mean = sum(values) / len(values)
     logger.info(f"Overall accuracy: {mean:.4f}")
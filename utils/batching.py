@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, Sequence, Tuple
+
+
+def prefetched_batches(
+    samples: Sequence[Any],
+    batch_size: int,
+    build_prompts: Callable[[List[Any]], Any]
+) -> Iterator[Tuple[List[Any], Any]]:
+    """
+    Yield (batch, prompts) pairs with prompt construction prefetched.
+
+    While the caller runs batch i on the GPU, batch i+1's prompts are already
+    being built on a background thread, so the GPU does not sit idle between
+    batches waiting on CPU-side string work.
+
+    Args:
+        samples: Samples to split into batches
+        batch_size: Number of samples per batch
+        build_prompts: Callable mapping a batch of samples to its prompts
+            (any structure; it is yielded alongside the batch unchanged)
+
+    Yields:
+        Tuples of (batch, prompts) in order
+    """
+    batches = [list(samples[start:start + batch_size]) for start in range(0, len(samples), batch_size)]
+    if not batches:
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        next_prompts = prefetcher.submit(build_prompts, batches[0])
+        for batch_idx, batch in enumerate(batches):
+            prompts = next_prompts.result()
+            if batch_idx + 1 < len(batches):
+                next_prompts = prefetcher.submit(build_prompts, batches[batch_idx + 1])
+            yield batch, prompts
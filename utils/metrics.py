@@ -1,5 +1,20 @@
 import re
 import json
+import numpy as np
+
+
+# Compiled once at import: the evaluation loops run these per response, and
+# precompiled patterns skip the re-cache lookup and parse on every call.
+
+# Fallback knowledge-object pattern: one alternation covers both the
+# ```json-fenced and the bare {...} formats in a single scan (a fenced match
+# consumes its inner object, so the bare branch never double-counts it). The
+# bare branch subsumes the old inline pattern
+_KNOWLEDGE_PATTERN = re.compile(
+    r'```json\s*(?P<fenced>{.*?"knowledge":.*?})\s*```|(?P<bare>{\s*"knowledge":.*?})',
+    re.DOTALL
+)
+
 
 
 def extract_knowledge_from_text(text):
@@ -12,66 +27,121 @@ def extract_knowledge_from_text(text):
     Returns:
         Extracted knowledge string
     """
-    # Clean text if it starts/ends with code block markers
+    # Clean text if it starts/ends with code block markers. Slice the exact
+    # marker: lstrip/rstrip treat their argument as a character set, so
+    # lstrip("```json") would also eat leading j/s/o/n characters
     cleaned_text = text
     if cleaned_text.startswith("```json"):
-        cleaned_text = cleaned_text.lstrip("```json")
+        cleaned_text = cleaned_text[len("```json"):]
     if cleaned_text.endswith("```"):
-        cleaned_text = cleaned_text.rstrip("```")
-    
-    try:
-        # Try to parse as JSON first
-        knowledge_data = json.loads(cleaned_text)
-        return knowledge_data.get("knowledge", "")
-    except Exception:
-        
-        # Fallback extraction methods
-        knowledge = ""
-        if "\"knowledge\":" in cleaned_text:
-            knowledge = cleaned_text.split("\"knowledge\":")[-1].strip()
-        
-        # Clean quotation marks
-        if knowledge.startswith("\""):
-            knowledge = knowledge.lstrip("\"")
-        if knowledge.endswith("\""):
-            knowledge = knowledge.rstrip("\"")
-        
-        return knowledge
+        cleaned_text = cleaned_text[:-3]
+    cleaned_text = cleaned_text.strip()
+
+    # Only run the JSON decoder when the payload can actually be an object
+    if cleaned_text.startswith("{"):
+        try:
+            knowledge_data = json.loads(cleaned_text)
+        except ValueError:
+            pass
+        else:
+            if isinstance(knowledge_data, dict):
+                return knowledge_data.get("knowledge", "")
+
+    # Fallback extraction methods
+    knowledge = ""
+    if "\"knowledge\":" in cleaned_text:
+        knowledge = cleaned_text.split("\"knowledge\":")[-1].strip()
+
+    # Clean quotation marks
+    if knowledge.startswith("\""):
+        knowledge = knowledge.lstrip("\"")
+    if knowledge.endswith("\""):
+        knowledge = knowledge.rstrip("\"")
+
+    return knowledge
+
+
+def _find_last_knowledge_json(text):
+    """
+    Find the last top-level {...} object containing a "knowledge" key.
+
+    Single left-to-right scan tracking brace depth and string literals (with
+    backslash escapes), so it runs in linear time where the backtracking
+    regex alternatives are quadratic on long mixed-text responses. Quotes in
+    surrounding prose are ignored because string state is only tracked inside
+    an object.
+
+    Args:
+        text: Model response text
+
+    Returns:
+        The last candidate object substring, or None if none is found
+    """
+    last_match = None
+    object_start = -1
+    depth = 0
+    in_string = False
+    escaped = False
+
+    for index, char in enumerate(text):
+        if depth == 0:
+            if char == '{':
+                object_start = index
+                depth = 1
+                in_string = False
+                escaped = False
+        elif in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                candidate = text[object_start:index + 1]
+                if '"knowledge"' in candidate:
+                    last_match = candidate
+
+    return last_match
 
 
 def extract_last_knowledge_object(text):
     """
-    Extract the last knowledge object from model response text using multiple pattern matching strategies.
-    
+    Extract the last knowledge object from model response text.
+
+    A one-pass brace-depth scan finds the candidate object; the original
+    regex strategies remain as a fallback for responses with unbalanced
+    braces that the scanner cannot pair up.
+
     Args:
         text: Model response text
-    
+
     Returns:
         Extracted knowledge string
     """
-    # Pattern 1: Match ```json\n{...}\n``` format
-    pattern_codeblock = r'```json\s*({.*?"knowledge":.*?})\s*```'
-    
-    # Pattern 2: Match multi-line JSON (without ```json markers)
-    pattern_multiline = r'{\s*"knowledge":.*?}'
-    
-    # Pattern 3: Match inline {"knowledge": ...} format
-    pattern_inline = r'{"knowledge":.*?}(?=(?:[^"]*"[^"]*")*[^"]*$)'
-
-    # Try code block format first
-    codeblock_matches = re.findall(pattern_codeblock, text, re.DOTALL)
-    if codeblock_matches:
-        return extract_knowledge_from_text(f"```json\n{codeblock_matches[-1]}\n```")
+    candidate = _find_last_knowledge_json(text)
+    if candidate is not None:
+        return extract_knowledge_from_text(candidate)
 
-    # Try multi-line JSON format
-    multiline_matches = re.findall(pattern_multiline, text, re.DOTALL)
-    if multiline_matches:
-        return extract_knowledge_from_text(multiline_matches[-1])
+    # One regex pass collects both formats; fenced matches keep priority over
+    # bare ones like the old three sequential scans
+    last_fenced = last_bare = None
+    for match in _KNOWLEDGE_PATTERN.finditer(text):
+        if match.group('fenced') is not None:
+            last_fenced = match.group('fenced')
+        else:
+            last_bare = match.group('bare')
 
-    # Try inline JSON format
-    inline_matches = re.findall(pattern_inline, text)
-    if inline_matches:
-        return extract_knowledge_from_text(inline_matches[-1])
+    if last_fenced is not None:
+        return extract_knowledge_from_text(last_fenced)
+    if last_bare is not None:
+        return extract_knowledge_from_text(last_bare)
 
     return ""
 
@@ -93,26 +163,47 @@ def extract_last_boxed_answer(text):
         str or None: The extracted answer option (A, B, C, or D), 
                     or None if no valid option is found
     """
-    # Regex pattern to match various \\boxed{} formats
-    boxed_matches = re.findall(r'\\boxed\{(\s*\\text\{([^}]*)\}|\s*\{?([A-D][\.\s].*?\}?)\}?|\s*([A-D])\s*)\}', text)
-    
-    # Extract all matched options, prioritizing inner content
+    # Cheap probe first: responses with no \boxed at all skip the scan
+    # entirely, and starting at the first occurrence bounds its work
+    needle = '\\boxed{'
+    position = text.find(needle)
+    if position == -1:
+        return None
+
+    # Hand-rolled scan instead of the old nested-alternation regex: for each
+    # \boxed{, walk forward matching braces to find the close (linear, no
+    # backtracking), then classify the body with plain string tests
+    text_length = len(text)
     extracted_options = []
-    for match in boxed_matches:
-        # Match format: \\boxed{\\text{...}}
-        if match[1]:
-            content = match[1]
-        # Match format: \\boxed{A.xxx} or variants
-        elif match[2]:
-            content = match[2]
-        # Match format: \\boxed{A}
-        elif match[3]:
-            content = match[3]
+    while position != -1:
+        body_start = position + len(needle)
+        depth = 1
+        index = body_start
+        while index < text_length and depth:
+            char = text[index]
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+            index += 1
+        if depth:  # Unterminated \boxed{; nothing further can close it
+            break
+        content = text[body_start:index - 1].strip()
+        position = text.find(needle, index)
+
+        # Format: \\boxed{\\text{...}}
+        if content.startswith('\\text{') and content.endswith('}'):
+            content = content[len('\\text{'):-1].strip()
         else:
-            continue
-        
-        # Remove extra braces and whitespace
-        content = content.strip()
+            # Remove one optional level of extra braces
+            if content.startswith('{') and content.endswith('}'):
+                content = content[1:-1].strip()
+            # Formats: \\boxed{A} and \\boxed{A.xxx}; anything else did not
+            # match the old answer pattern and stays invisible
+            if not (content[:1] in ('A', 'B', 'C', 'D')
+                    and (len(content) == 1 or content[1] == '.' or content[1].isspace())):
+                continue
+
         if content:
             extracted_options.append(content)
     
@@ -122,15 +213,15 @@ def extract_last_boxed_answer(text):
     # Get the last boxed content
     last_boxed = extracted_options[-1]
     
-    # Check if it's a single A/B/C/D option
-    if re.fullmatch(r'[A-D]', last_boxed):
+    # Check if it's a single A/B/C/D option; plain character tests beat the
+    # regex VM for these one- and two-character probes
+    if len(last_boxed) == 1 and last_boxed in 'ABCD':
         return last_boxed
-    
+
     # Check if it's A.xxx/B.xxx format
-    match = re.match(r'^([A-D])[\.\s].*', last_boxed)
-    if match:
-        return match.group(1)
-    
+    if len(last_boxed) >= 2 and last_boxed[0] in 'ABCD' and (last_boxed[1] == '.' or last_boxed[1].isspace()):
+        return last_boxed[0]
+
     return None
 
 
@@ -150,12 +241,17 @@ def calculate_accuracy(predictions, answers):
     """
     if len(predictions) != len(answers):
         raise ValueError("Number of predictions and answers must be equal")
-    
-    correct = 0
-    for pred, ans in zip(predictions, answers):
-        # Compare ignoring case, None predictions are considered incorrect
-        if pred is not None and pred.upper() == ans.upper():
-            correct += 1
-    
-    return correct / len(predictions) if len(predictions) > 0 else 0.0
+
+    if len(predictions) == 0:
+        return 0.0
+
+    # One C-level compare replaces the per-sample Python loop. None
+    # predictions map to "" so they never match; comparison ignores case
+    pred_array = np.char.upper(np.array(['' if pred is None else pred for pred in predictions]))
+    answer_array = np.asarray(answers)
+    if not np.char.isupper(answer_array).all():
+        # Ground-truth answers are normally already bare A/B/C/D letters, so
+        # the uppercase copy is only allocated when one actually needs it
+        answer_array = np.char.upper(answer_array)
+    return float((pred_array == answer_array).sum()) / len(predictions)
 
@@ -1,6 +1,13 @@
 from typing import Tuple
 
 
+# Constant system prompts hoisted to module level: the builders run once per
+# sample in the evaluation loops, so returning the same interned string avoids
+# re-allocating it on every call
+TEACHER_SYSTEM_PROMPT = "你是一名国际汉语教师。"
+STUDENT_SYSTEM_PROMPT = "你是一名正在学习汉语知识的学生。"
+
+
 def build_task1_prompt(query: str, field: str) -> str:
     """
     Build a prompt template for single-choice questions.
@@ -12,7 +19,7 @@ def build_task1_prompt(query: str, field: str) -> str:
     Returns:
         Formatted prompt string
     """
-    return "以下是关于{}的单项选择题，请选出正确答案并将选项填写到\\boxed{{}}中。\n\n{}".format(field, query)
+    return f"以下是关于{field}的单项选择题，请选出正确答案并将选项填写到\\boxed{{}}中。\n\n{query}"
 
 
 def build_task2_prompt(query: str, text: str) -> str:
@@ -27,10 +34,10 @@ def build_task2_prompt(query: str, text: str) -> str:
         Formatted prompt string
     """
     return (
-        "阅读以下材料并回答问题，选出唯一正确答案并将选项填写到\\boxed{{}}中。\n\n"
-        "# 材料：\n{}\n\n"
-        "# 问题：\n{}"
-    ).format(text, query)
+        "阅读以下材料并回答问题，选出唯一正确答案并将选项填写到\\boxed{}中。\n\n"
+        f"# 材料：\n{text}\n\n"
+        f"# 问题：\n{query}"
+    )
 
 
 def build_teacher_prompt(teaching_guide: str, text: str) -> Tuple[str, str]:
@@ -44,13 +51,12 @@ def build_teacher_prompt(teaching_guide: str, text: str) -> Tuple[str, str]:
     Returns:
         tuple: (System role prompt, Teaching prompt)
     """
-    system_prompt = "你是一名国际汉语教师。"
     prompt = (
-        "阅读以下材料，依据材料结合教学提示向学生传授相关知识，以{{\"knowledge\": 知识内容}}的格式输出。\n\n"
-        "# 材料：\n{}\n\n"
-        "# 教学提示：\n{}"
-    ).format(text, teaching_guide)
-    return system_prompt, prompt
+        "阅读以下材料，依据材料结合教学提示向学生传授相关知识，以{\"knowledge\": 知识内容}的格式输出。\n\n"
+        f"# 材料：\n{text}\n\n"
+        f"# 教学提示：\n{teaching_guide}"
+    )
+    return TEACHER_SYSTEM_PROMPT, prompt
 
 
 def build_student_prompt(query: str, text: str) -> Tuple[str, str]:
@@ -64,13 +70,12 @@ def build_student_prompt(query: str, text: str) -> Tuple[str, str]:
     Returns:
         tuple: (System role prompt, Study prompt)
     """
-    system_prompt = "你是一名正在学习汉语知识的学生。"
     prompt = (
-        "阅读以下材料，选出唯一正确答案并将选项填写到\\boxed{{}}中。\n\n"
-        "# 材料：\n{}\n\n"
-        "# 问题：\n{}"
-    ).format(text, query)
-    return system_prompt, prompt
+        "阅读以下材料，选出唯一正确答案并将选项填写到\\boxed{}中。\n\n"
+        f"# 材料：\n{text}\n\n"
+        f"# 问题：\n{query}"
+    )
+    return STUDENT_SYSTEM_PROMPT, prompt
 
 
 def build_guided_student_prompt(query: str, text: str, knowledge: str) -> Tuple[str, str]:
@@ -85,14 +90,13 @@ def build_guided_student_prompt(query: str, text: str, knowledge: str) -> Tuple[
     Returns:
         tuple: (System role prompt, Study prompt)
     """
-    system_prompt = "你是一名正在学习汉语知识的学生。"
     prompt = (
-        "阅读以下材料，结合教师传授的知识回答问题，选出唯一正确答案并将选项填写到\\boxed{{}}中。\n\n"
-        "# 材料：\n{}\n\n"
-        "# 教师传授的知识：\n{}\n\n"
-        "# 问题：\n{}"
-    ).format(text, knowledge, query)
-    return system_prompt, prompt
+        "阅读以下材料，结合教师传授的知识回答问题，选出唯一正确答案并将选项填写到\\boxed{}中。\n\n"
+        f"# 材料：\n{text}\n\n"
+        f"# 教师传授的知识：\n{knowledge}\n\n"
+        f"# 问题：\n{query}"
+    )
+    return STUDENT_SYSTEM_PROMPT, prompt
 
 if __name__ == "__main__":
     item={